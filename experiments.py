@@ -4,6 +4,11 @@ import sys
 import re
 from itertools import chain
 
+try:
+    import re2
+except ImportError:
+    re2 = None
+
 # import framework
 from framework import Experiment, ExperimentEngine
 
@@ -11,6 +16,58 @@ from framework import Experiment, ExperimentEngine
 OINK = "tools/oink"
 
 
+# "solved with" lines, by the index of the last group of their alternative
+SOLVED_MAJOR_MINOR = 2
+SOLVED_ITERATIONS = 3
+SOLVED_PROMOTIONS = 4
+SOLVED_TANGLES_ITERATIONS = 6
+SOLVED_TANGLES = 7
+
+
+class LogPatterns(object):
+    """The patterns used by ExpOink.parse_log, compiled once with the given
+    regex module (logs are parsed as bytes).
+    """
+    def __init__(self, module):
+        self.solving = module.compile(rb'solving took ([\d\.,]+)')
+        self.preprocessing = module.compile(rb'preprocessing took ([\d\.,]+)')
+        self.time = module.compile(rb'total solving time: ([\d\.,]+)')
+        self.nodes_edges = module.compile(rb'with ([\d]+) nodes and ([\d]+) edges')
+        # all "solved with" lines are found in a single scan
+        self.solved = module.compile(
+            rb'solved with (?:'
+            rb'([\d\.,]+) major iterations, ([\d\.,]+) minor iterations'
+            rb'|([\d\.,]+) iterations'
+            rb'|([\d\.,]+) promotions'
+            rb'|([\d\.,]+) tangles and ([\d\.,]+) iterations'
+            rb'|([\d]+) tangles)')
+
+
+DIGITS = frozenset(b'0123456789')
+
+
+def find_digits_before(contents, suffix):
+    r"""Find the digits in front of the first <suffix> preceded by a digit,
+    i.e., search for rb'([\d]+)' + suffix, but locate the suffix with find
+    instead of trying the regex at every digit in the log.
+    """
+    i = contents.find(suffix)
+    while i >= 0:
+        j = i
+        while j > 0 and contents[j-1] in DIGITS:
+            j -= 1
+        if j < i:
+            return contents[j:i]
+        i = contents.find(suffix, i + 1)
+    return None
+
+
+LOG_PATTERNS = LogPatterns(re)
+# RE2 has more overhead per search than re, but scans large logs much faster
+LOG_PATTERNS_RE2 = LogPatterns(re2) if re2 is not None else None
+RE2_MIN_SIZE = 4096
+
+
 ###
 # We have some classes implementing Experiment:
 # - <parse_log> to parse a log file into a result dictionary (or None)
@@ -19,59 +76,73 @@ OINK = "tools/oink"
 
 
 class ExpOink(Experiment):
-    def __init__(self, name, model):
-        super().__init__(name=name, call=[], group=name)
-        self.group = name
-        self.solver = ""
-        self.name = f"{name}"
-        self.call = [OINK, model, "-v"]
+    def __init__(self, name, model, solver="", options=()):
+        """The solver and its options can be given directly, which is the same
+        as, but cheaper than, chaining the methods below.
+        """
+        super().__init__(name=f"{name}-{solver}" if solver else name,
+                         call=[OINK, model, "-v", *options], group=name)
+        self.solver = solver
         self.model = model
 
     def parse_log(self, contents):
-        s = re.search(r'solution verified', contents)
-        if not s:
+        # cheap substring test first, so unverified logs skip all regexes
+        # (find rather than "in", which does not search substrings of an mmap)
+        if contents.find(b'solution verified') < 0:
             return None
+        if LOG_PATTERNS_RE2 is not None and len(contents) >= RE2_MIN_SIZE:
+            patterns = LOG_PATTERNS_RE2
+        else:
+            patterns = LOG_PATTERNS
         res = {}
-        s = re.search(r'solving took ([\d\.,]+)', contents)
+        s = patterns.solving.search(contents)
         if s:
             res['solving'] = float(s.group(1))
         else:
             res['solving'] = float(0)
-        s = re.search(r'preprocessing took ([\d\.,]+)', contents)
+        s = patterns.preprocessing.search(contents)
         if s:
             res['preprocessing'] = float(s.group(1))
         else:
             res['preprocessing'] = float(0)
-        s = re.search(r'total solving time: ([\d\.,]+)', contents)
+        s = patterns.time.search(contents)
         if s:
             res['time'] = float(s.group(1))
-        s = re.search(r'with ([\d]+) nodes and ([\d]+) edges', contents)
+        s = patterns.nodes_edges.search(contents)
         if s:
             res['nodes'] = int(s.group(1))
             res['edges'] = int(s.group(2))
         else:
             res['nodes'] = res['edges'] = 0
-        s = re.search(r'([\d]+) priorities', contents)
+        s = find_digits_before(contents, b' priorities')
         if s:
-            res['priorities'] = int(s.group(1))
+            res['priorities'] = int(s)
         else:
             res['priorities'] = 0
-        s = re.search(r'solved with ([\d\.,]+) major iterations, ([\d\.,]+) minor iterations', contents)
+        # keep the first "solved with" line of each kind
+        solved = {}
+        for s in patterns.solved.finditer(contents):
+            if s.lastindex not in solved:
+                solved[s.lastindex] = s
+        # the most specific line gives the iterations: tangles and iterations,
+        # then plain iterations, and only then major + minor iterations
+        tangles_iterations = solved.get(SOLVED_TANGLES_ITERATIONS)
+        s = tangles_iterations or solved.get(SOLVED_ITERATIONS)
         if s:
-            res['iterations'] = int(s.group(1)+s.group(2)) # major + minor
-        s = re.search(r'solved with ([\d\.,]+) iterations', contents)
-        if s:
-            res['iterations'] = int(s.group(1))
-        s = re.search(r'solved with ([\d\.,]+) promotions', contents)
-        if s:
-            res['promotions'] = int(s.group(1))
-        s = re.search(r'solved with ([\d]+) tangles', contents)
-        if s:
-            res['tangles'] = int(s.group(1))
-        s = re.search(r'solved with ([\d\.,]+) tangles and ([\d\.,]+) iterations', contents)
+            res['iterations'] = int(s.group(s.lastindex))
+        else:
+            s = solved.get(SOLVED_MAJOR_MINOR)
+            if s:
+                res['iterations'] = int(s.group(1)+s.group(2)) # major + minor
+        s = solved.get(SOLVED_PROMOTIONS)
         if s:
-            res['tangles'] = int(s.group(2))
-            res['iterations'] = int(s.group(2))
+            res['promotions'] = int(s.group(SOLVED_PROMOTIONS))
+        if tangles_iterations:
+            res['tangles'] = int(tangles_iterations.group(SOLVED_TANGLES_ITERATIONS))
+        else:
+            s = solved.get(SOLVED_TANGLES)
+            if s:
+                res['tangles'] = int(s.group(SOLVED_TANGLES))
         return res
 
     def get_text(self, res):
@@ -146,6 +217,36 @@ class ExpOink(Experiment):
         return self
 
 
+# options of the solvers used by OinkExperiments, which are all run with nosp
+NOSP = ["--no-loops", "--no-single", "--no-wcwc"]
+OINK_SOLVERS = {
+    'fpi': ["--fpi", "-w", "1"],
+    'fpj': ["--fpj", "-w", "1"],
+    'tl': ["--tl"],
+    'rtl': ["--rtl"],
+    'ortl': ["--ortl"],
+    'npp': ["--npp"],
+    'zlk': ["--zlk", "-w", "1"],
+}
+
+
+def make_nosp_solver(solver, options):
+    """Make a constructor for ExpOink(name, model).<solver>().nosp()
+    that sets all fields at once.
+    """
+    solver = f"{solver}-n"
+    options = options + NOSP
+
+    def make(cls, name, model):
+        return cls(name, model, solver, options)
+    return classmethod(make)
+
+
+# define ExpOink.make_fpi, ExpOink.make_fpj, etc.
+for solver, options in OINK_SOLVERS.items():
+    setattr(ExpOink, f"make_{solver}", make_nosp_solver(solver, options))
+
+
 ###
 # Now that we have defined our experiments, we define the collections
 ###
@@ -155,15 +256,19 @@ class FileFinder(object):
     def __init__(self, directory, extensions):
         self.directory = directory
         self.extensions = extensions
+        self._ext_tuple = tuple("." + ext for ext in extensions)
 
     def __iter__(self):
         if not hasattr(self, 'files'):
             self.files = []
-            for ext in self.extensions:
-                dotext = "." + ext
-                # get all files in directory ending with the extension
-                files = [f[:-len(dotext)] for f in filter(lambda f: f.endswith(dotext) and os.path.isfile(self.directory+"/"+f), os.listdir(self.directory))]
-                self.files.extend([(x, "{}/{}{}".format(self.directory, x, dotext)) for x in files])
+            # get all files in directory ending with one of the extensions
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(self._ext_tuple) or not entry.is_file():
+                        continue
+                    for dotext in self._ext_tuple:
+                        if entry.name.endswith(dotext):
+                            self.files.append((entry.name[:-len(dotext)], entry.path))
         return self.files.__iter__()
 
 
@@ -175,15 +280,7 @@ class OinkExperiments(object):
         self.solvers = solvers
 
     def get_solvers(self):
-        return {
-            'fpi': lambda name, filename: ExpOink(name, filename).fpi().nosp(),
-            'fpj': lambda name, filename: ExpOink(name, filename).fpj().nosp(),
-            'tl': lambda name, filename: ExpOink(name, filename).tl().nosp(),
-            'rtl': lambda name, filename: ExpOink(name, filename).rtl().nosp(),
-            'ortl': lambda name, filename: ExpOink(name, filename).ortl().nosp(),
-            'npp': lambda name, filename: ExpOink(name, filename).npp().nosp(),
-            'zlk': lambda name, filename: ExpOink(name, filename).zlk().nosp(),
-            }
+        return {solver: getattr(ExpOink, f"make_{solver}") for solver in OINK_SOLVERS}
 
     def __iter__(self):
         if not hasattr(self, 'grouped'):
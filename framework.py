@@ -1,22 +1,86 @@
 #!/usr/bin/env python3
 import json
+import mmap
 import os
+import signal
 import sys
+import threading
 from subprocess import Popen, TimeoutExpired
+from concurrent.futures import ProcessPoolExecutor
 import time
 import random
 import itertools
+from array import array
+from collections import Counter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def call(args, stdout=None, stderr=None, timeout=None, env=None):
+    """Run <args> and return its exit code.
+    On timeout, terminate the process and raise TimeoutExpired.
+    Uses posix_spawn where available, avoiding the overhead of Popen.
+    """
+    # print("calling {}".format(str(args)))
+    if not hasattr(os, 'posix_spawnp') or not hasattr(os, 'waitid'):
+        with Popen(args, stdout=stdout, stderr=stderr, env=env) as p:
+            try:
+                return p.wait(timeout=timeout)
+            except TimeoutExpired:
+                p.terminate()
+                p.wait()
+                raise
 
-
-def call(*popenargs, timeout=None, **kwargs):
-    # print("calling {}".format(str(popenargs)))
-    with Popen(*popenargs, **kwargs) as p:
-        try:
-            return p.wait(timeout=timeout)
-        except TimeoutExpired:
-            p.terminate()
-            p.wait()
-            raise
+    file_actions = []
+    if stdout is not None:
+        file_actions.append((os.POSIX_SPAWN_DUP2, stdout.fileno(), 1))
+    if stderr is not None:
+        file_actions.append((os.POSIX_SPAWN_DUP2, stderr.fileno(), 2))
+    # restore the signals Python ignores, like Popen(restore_signals=True) does
+    pid = os.posix_spawnp(args[0], args, os.environ if env is None else env, file_actions=file_actions,
+                          setsigdef=(signal.SIGPIPE, signal.SIGXFSZ))
+
+    expired = []
+
+    def terminate():
+        expired.append(True)
+        os.kill(pid, signal.SIGTERM)
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, terminate)
+        timer.start()
+    try:
+        # wait without reaping, so the pid cannot be reused while the timer may still fire
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    finally:
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+        _, status = os.waitpid(pid, 0)
+    if expired:
+        raise TimeoutExpired(args, timeout)
+    return os.waitstatus_to_exitcode(status)
+
+
+def get_stat_sig(filename):
+    """Get the (mtime, size) signature of a file, or None if it does not exist.
+    """
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def check_log(experiment, logfile):
+    """Get the status of an experiment and the signature of its log file.
+    Module-level so it can run in the worker processes of fill_results.
+    """
+    return experiment.get_status_and_sig(logfile)
 
 
 class Experiment(object):
@@ -28,15 +92,28 @@ class Experiment(object):
     def __init__(self, name, call, group=None):
         self.name = name
         self.call = call
-        self.env = dict(os.environ)
+        self._env = None
         self.group = group
         self.repeat = True
 
     def __repr__(self):
         return self.name
 
+    @property
+    def env(self):
+        """The environment of the experiment, copied from os.environ when
+        first accessed; until then, the experiment runs in os.environ.
+        """
+        if self._env is None:
+            self._env = dict(os.environ)
+        return self._env
+
+    @env.setter
+    def env(self, env):
+        self._env = env
+
     def parse_log(self, contents):
-        """Parse the log file.
+        """Parse the log file, given as a bytes-like object.
         Return None if not good, or a dict with the results otherwise.
         """
         raise NotImplementedError
@@ -54,31 +131,45 @@ class Experiment(object):
         Experiment.TIMEOUT, time
         Experiment.NOTDONE, None
         """
-        if os.path.isfile(filename):
-            try:
-                with open(filename, 'r') as handle:
+        status, value, _ = self.get_status_and_sig(filename)
+        return status, value
+
+    def get_status_and_sig(self, filename):
+        """Obtain the status of the experiment, like get_status, together with
+        the (mtime, size) signature of the log file, or None if it does not exist.
+        """
+        try:
+            handle = open(filename, 'rb')
+        except FileNotFoundError:
+            stat_sig = None
+        else:
+            with handle:
+                st = os.fstat(handle.fileno())
+                stat_sig = st.st_mtime_ns, st.st_size
+                # map larger logs instead of copying them; small ones are just read
+                if st.st_size >= mmap.PAGESIZE:
+                    with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                        res = self.parse_log(contents)
+                else:
                     res = self.parse_log(handle.read())
-                    if res is not None:
-                        if 'error' in res:
-                            return Experiment.ERROR, res
-                        else:
-                            return Experiment.DONE, res
-            except UnicodeDecodeError:
-                print("Unicode error in file "+filename+"!")
-                raise
+                if res is not None:
+                    if 'error' in res:
+                        return Experiment.ERROR, res, stat_sig
+                    else:
+                        return Experiment.DONE, res, stat_sig
 
         timeout_filename = "{}.timeout".format(filename)
-        if os.path.isfile(timeout_filename):
-            try:
-                with open(timeout_filename, 'r') as handle:
-                    return Experiment.TIMEOUT, int(handle.read())
-            except Exception:
-                return Experiment.NOTDONE, None
+        try:
+            with open(timeout_filename, 'r') as handle:
+                return Experiment.TIMEOUT, int(handle.read()), stat_sig
+        except FileNotFoundError:
+            pass
+        except Exception:
+            return Experiment.NOTDONE, None, stat_sig
+        if stat_sig is not None:
+            return Experiment.ERROR, {'error': 'unknown error'}, stat_sig
         else:
-            if os.path.isfile(filename):
-                return Experiment.ERROR, {'error': 'unknown error'}
-            else:
-                return Experiment.NOTDONE, None
+            return Experiment.NOTDONE, None, stat_sig
 
     def run_experiment(self, timeout, filename):
         # remove output and timeout files
@@ -94,7 +185,7 @@ class Experiment(object):
 
         try:
             with open(filename, 'w+') as out:
-                call(self.call, stdout=out, stderr=out, timeout=timeout, env=self.env)
+                call(self.call, stdout=out, stderr=out, timeout=timeout, env=self._env)
         except KeyboardInterrupt:
             # if CTRL-C was hit, move the file
             os.rename(filename, "{}.interrupted".format(filename))
@@ -140,6 +231,23 @@ def flatten_iter(x):
                 yield it
 
 
+def flatten_collections(collections):
+    """Flatten a list of experiment collections to a list of experiments.
+    Collections normally yield groups, i.e., lists of experiments; these are
+    joined with itertools.chain. Any other shape, including groups that
+    contain nested iterables, falls back to flatten_iter.
+    """
+    flat = []
+    for collection in collections:
+        groups = list(collection) if hasattr(collection, '__iter__') else [collection]
+        if all(isinstance(group, list) and not any(hasattr(x, '__iter__') for x in group)
+               for group in groups):
+            flat += itertools.chain.from_iterable(groups)
+        else:
+            flat += flatten_iter(groups)
+    return flat
+
+
 ###
 # We use a lazy ExperimentCollection because evaluating a
 # collection to the individual experiments results in work
@@ -153,28 +261,43 @@ class ExperimentCollection(object):
         self.lazy = []
         self.flat = []
         self.filter = None
+        self._cached_filtered = None
+        self._by_group = None
 
     def __iadd__(self, other):
         self.lazy.append(other)
+        self._cached_filtered = None
+        self._by_group = None
         return self
 
     def __iter__(self):
-        if len(self.lazy) > 0:
-            self.flat += flatten_iter(self.lazy)
-            self.lazy = []
-        return filter(self.filter, iter(self.flat))
+        return iter(self._filtered())
 
     def __len__(self):
-        if len(self.lazy) > 0:
-            self.flat += flatten_iter(self.lazy)
-            self.lazy = []
-        if self.filter is None:
-            return len(self.flat)
-        else:
-            return sum(1 for x in self.flat if self.filter(x))
+        return len(self._filtered())
+
+    def _filtered(self):
+        """Get the list of filtered experiments, which is kept until
+        experiments are added or the filter changes.
+        """
+        if self._cached_filtered is None:
+            if len(self.lazy) > 0:
+                self.flat += flatten_collections(self.lazy)
+                self.lazy = []
+            self._cached_filtered = list(filter(self.filter, self.flat))
+        return self._cached_filtered
+
+    def iter_sorted_by_group(self):
+        """Iterate over the filtered experiments, ordered by group.
+        """
+        if self._by_group is None:
+            self._by_group = sorted(self._filtered(), key=lambda e: e.group)
+        return iter(self._by_group)
 
     def setfilter(self, filter_function):
         self.filter = filter_function
+        self._cached_filtered = None
+        self._by_group = None
 
 
 class ExperimentEngine(object):
@@ -183,15 +306,31 @@ class ExperimentEngine(object):
         - logdir (default "logs")
         - cachefile (default "cache.json")
         - timeout (default 1200 seconds)
+        - notdone_ttl (default 5 seconds)
+        - workers (default os.cpu_count())
+        - parallel_threshold (default 1000 uncached experiments)
         """
         self.experiments = ExperimentCollection()
         self.logdir = kwargs.get('logdir', 'logs')
         self.timeout = int(kwargs.get('timeout', 1200))
         self.cachefile = kwargs.get('cachefile', 'cache.json')
-        self.results = []
+        self.notdone_ttl = float(kwargs.get('notdone_ttl', 5))
+        self.workers = int(kwargs.get('workers', os.cpu_count() or 1))
+        self.parallel_threshold = int(kwargs.get('parallel_threshold', 1000))
+        # cached results per iteration, as arrays indexed by experiment id:
+        # the status (NOTDONE means no result), the value and the log signature
+        self._id = {}
+        self._names = []
+        self._status = []
+        self._values = []
+        self._sigs = []
+        self._groups = None
+        # when (iteration, name) was last found not done, by time.monotonic()
+        self._neg_cache = {}
 
     def __iadd__(self, other):
         self.experiments += other
+        self._groups = None
         return self
 
     def __iter__(self):
@@ -202,6 +341,7 @@ class ExperimentEngine(object):
 
     def setfilter(self, filter_function):
         self.experiments.setfilter(filter_function)
+        self._groups = None
 
     def initialize(self, iterations=None, verbose=True):
         # create directory for logs if not exists
@@ -213,24 +353,70 @@ class ExperimentEngine(object):
         self.fill_results(iterations=iterations, verbose=verbose)
 
     def sanity_check(self):
-        names_set = set()
-        count = 0
-        for e in self:
-            names_set.add(e.name)
-            count += 1
-        if len(names_set) != count:
+        counts = Counter(e.name for e in self)
+        duplicates = [name for name, count in counts.items() if count > 1]
+        if len(duplicates) != 0:
             print("Sanity check failed!")
-            names_list = [e.name for e in self]
-            for name in names_set:
-                if sum([1 for x in names_list if x == name]) != 1:
-                    print("{} occurs multiple times!".format(name))
+            for name in duplicates:
+                print("{} occurs multiple times!".format(name))
             exit(0)
+        # assign experiment ids
+        for name in sorted(counts):
+            self.get_exp_id(name)
+
+    def get_exp_id(self, name):
+        """Get the index of experiment <name> in the result arrays, assigning
+        a new one if needed.
+        """
+        eid = self._id.get(name)
+        if eid is None:
+            eid = self._id[name] = len(self._names)
+            self._names.append(name)
+            for i in range(len(self._status)):
+                self._status[i].append(Experiment.NOTDONE)
+                self._values[i].append(None)
+                self._sigs[i].append(None)
+        return eid
 
     def extend_for_iteration(self, iteration):
-        """Ensure the <results> array is large enough.
+        """Ensure the result arrays are large enough.
+        """
+        while len(self._status) <= iteration:
+            n = len(self._names)
+            self._status.append(array('b', [Experiment.NOTDONE]) * n)
+            self._values.append([None] * n)
+            self._sigs.append([None] * n)
+
+    def clear_results(self):
+        self._status = []
+        self._values = []
+        self._sigs = []
+
+    def get_iterations(self):
+        """Get the number of iterations with (possibly empty) results.
+        """
+        return len(self._status)
+
+    def count_results(self, iteration, status=None):
+        """Count the cached results of <iteration>, optionally only those with <status>.
+        """
+        if status is None:
+            return len(self._status[iteration]) - self._status[iteration].count(Experiment.NOTDONE)
+        return self._status[iteration].count(status)
+
+    def iter_results(self, iteration):
+        """Iterate over the cached results of <iteration> as (name, status, value).
         """
-        while len(self.results) <= iteration:
-            self.results.append({})
+        values = self._values[iteration]
+        for eid, status in enumerate(self._status[iteration]):
+            if status != Experiment.NOTDONE:
+                yield self._names[eid], status, values[eid]
+
+    def set_result(self, name, iteration, status, value, stat_sig):
+        eid = self.get_exp_id(name)
+        self._status[iteration][eid] = status
+        self._values[iteration][eid] = value
+        self._sigs[iteration][eid] = stat_sig
 
     def get_logfile(self, experiment, iteration):
         return "{}/{}-{}".format(self.logdir, experiment.name, iteration)
@@ -239,22 +425,40 @@ class ExperimentEngine(object):
         """Get the status of the experiment.
         Returns from the cache unless the experiment timed out with a lower
         timeout than configured, because maybe there is an updated result.
+        In that case the log file is only parsed again if it changed.
+        Experiments that were not done less than <notdone_ttl> seconds ago
+        are reported as not done without checking the log file again.
         """
         # check first in the cache
-        if experiment.name in self.results[iteration]:
-            status, value = self.results[iteration][experiment.name]
+        eid = self.get_exp_id(experiment.name)
+        status = self._status[iteration][eid]
+        cached = status != Experiment.NOTDONE
+        if cached:
+            value = self._values[iteration][eid]
+            cached_sig = self._sigs[iteration][eid]
             # return cache result IF the timeout is not lower than configured
             if status != Experiment.TIMEOUT or value >= self.timeout:
                 return status, value
-        # check the log file
-        logfile = "{}/{}-{}".format(self.logdir, experiment.name, iteration)
-        status, value = experiment.get_status(logfile)
-        # update cache
-        if status != Experiment.NOTDONE:
-            self.results[iteration][experiment.name] = status, value
-        # return result
+        else:
+            checked = self._neg_cache.get((iteration, experiment.name))
+            if checked is not None and time.monotonic() - checked < self.notdone_ttl:
+                return Experiment.NOTDONE, None
+        # check the log file, unless it is unchanged since it was cached
+        logfile = self.get_logfile(experiment, iteration)
+        if cached and cached_sig is not None and cached_sig == get_stat_sig(logfile):
+            return status, value
+        status, value, stat_sig = experiment.get_status_and_sig(logfile)
+        self.store_status(experiment, iteration, status, value, stat_sig)
         return status, value
 
+    def store_status(self, experiment, iteration, status, value, stat_sig):
+        """Update the cache with the status obtained from a log file.
+        """
+        if status != Experiment.NOTDONE:
+            self.set_result(experiment.name, iteration, status, value, stat_sig)
+        else:
+            self._neg_cache[(iteration, experiment.name)] = time.monotonic()
+
     def print_status(self, experiment, iteration):
         """Get experiment status and print to stdout.
         Returns True if the status was DONE / TIMEOUT / ERROR, otherwise False.
@@ -278,39 +482,58 @@ class ExperimentEngine(object):
         """
         # get from file
         if os.path.isfile(self.cachefile):
-            with open(self.cachefile) as f:
-                self.results = json.load(f)
-            if clean:
-                exp_names = {e.name for e in self}
-                self.results = [{k: v for k, v in X.items() if k in exp_names} for X in self.results]
+            if orjson is not None:
+                with open(self.cachefile, 'rb') as f:
+                    results = orjson.loads(f.read())
+            else:
+                with open(self.cachefile) as f:
+                    results = json.load(f)
+            self.clear_results()
+            exp_names = {e.name for e in self}
+            for i, X in enumerate(results):
+                self.extend_for_iteration(i)
+                for k, v in X.items():
+                    if not clean or k in exp_names:
+                        # entries are [status, value, stat_sig]; older caches lack the stat_sig
+                        self.set_result(k, i, *self.load_cache_entry(*v))
             if verbose:
                 self.report_cache("Loaded")
 
+    @staticmethod
+    def load_cache_entry(status, value, stat_sig=None):
+        if stat_sig is not None:
+            stat_sig = tuple(stat_sig)
+        return status, value, stat_sig
+
     def save_cache(self, verbose=True):
         # first prune empty iterations
-        while len(self.results) > 0 and len(self.results[-1]) == 0:
-            self.results.pop()
-        # just json dump it
-        with open(self.cachefile, 'w') as f:
-            json.dump(self.results, f)
-            if verbose:
-                self.report_cache("Stored")
+        while len(self._status) > 0 and self.count_results(-1) == 0:
+            self._status.pop()
+            self._values.pop()
+            self._sigs.pop()
+        results = [{self._names[eid]: (status, self._values[i][eid], self._sigs[i][eid])
+                    for eid, status in enumerate(self._status[i]) if status != Experiment.NOTDONE}
+                   for i in range(len(self._status))]
+        # json dump it to a temporary file, then replace the cache file
+        tmpfile = self.cachefile + '.tmp'
+        if orjson is not None:
+            with open(tmpfile, 'wb') as f:
+                f.write(orjson.dumps(results))
+        else:
+            with open(tmpfile, 'w') as f:
+                json.dump(results, f)
+        os.replace(tmpfile, self.cachefile)
+        if verbose:
+            self.report_cache("Stored")
 
     def report_cache(self, prefix):
         # count stuff
-        count_done = 0
-        count_to = 0
-        count_err = 0
-        for it in self.results:
-            for status, value in it.values():
-                if status == Experiment.DONE:
-                    count_done += 1
-                elif status == Experiment.TIMEOUT:
-                    count_to += 1
-                elif status == Experiment.ERROR:
-                    count_err += 1
+        iterations = range(len(self._status))
+        count_done = sum(self.count_results(i, Experiment.DONE) for i in iterations)
+        count_to = sum(self.count_results(i, Experiment.TIMEOUT) for i in iterations)
+        count_err = sum(self.count_results(i, Experiment.ERROR) for i in iterations)
         print("{} {} results, {} timeouts, {} errors, {} iterations."
-              .format(prefix, count_done, count_to, count_err, len(self.results)))
+              .format(prefix, count_done, count_to, count_err, len(self._status)))
 
     def fill_results(self, iterations=None, verbose=True):
         """
@@ -321,20 +544,36 @@ class ExperimentEngine(object):
             self.load_cache(verbose=verbose)
         except Exception:
             print("Exception while loading cache, ignoring cache.")
-            self.results = []
+            self.clear_results()
 
-        for i in itertools.count():
-            if iterations is not None and i >= iterations:
-                return
-            self.extend_for_iteration(i)
-            for e in self:
-                if e.repeat or i == 0:
+        # with many uncached experiments, parse their logs in worker processes
+        pool = None
+        try:
+            for i in itertools.count():
+                if iterations is not None and i >= iterations:
+                    return
+                self.extend_for_iteration(i)
+                exps = [e for e in self if e.repeat or i == 0]
+                status = self._status[i]
+                uncached = [e for e in exps if status[self.get_exp_id(e.name)] == Experiment.NOTDONE]
+                if self.workers > 1 and len(uncached) >= self.parallel_threshold:
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=self.workers)
+                    logfiles = [self.get_logfile(e, i) for e in uncached]
+                    for e, res in zip(uncached, pool.map(check_log, uncached, logfiles, chunksize=64)):
+                        self.store_status(e, i, *res)
+                for e in exps:
                     self.get_status(e, i)
-            if len(self.results[i]) == 0:
-                return
+                if self.count_results(i) == 0:
+                    return
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
     def get_groups(self):
-        return list(set([x.group for x in self]))
+        if self._groups is None:
+            self._groups = list(set([x.group for x in self]))
+        return list(self._groups)
 
     def todo(self, by_group=True, iterations=1):
         """List all experiments/groups that we still need to run.
@@ -364,16 +603,16 @@ class ExperimentEngine(object):
         # if group is set, limit to experiments in the group
         if group is not None:
             experiments = [e for e in self if e.group == group]
+        # if by_group is set, order by group
+        elif by_group:
+            experiments = list(self.experiments.iter_sorted_by_group())
         else:
             experiments = list(self)
-        # if by_group is set, order by group
-        if by_group:
-            experiments.sort(key=lambda e: e.group)
         # report until empty iteration
         for i in itertools.count():
             if iterations is not None and i >= iterations:
                 return
-            if len(self.results) <= i or len(self.results[i]) == 0:
+            if len(self._status) <= i or self.count_results(i) == 0:
                 return
             for e in experiments:
                 if not e.repeat and i > 0:
@@ -389,7 +628,7 @@ class ExperimentEngine(object):
         for i in itertools.count():
             if iterations is not None and i >= iterations:
                 break
-            if len(self.results) <= i or len(self.results[i]) == 0:
+            if len(self._status) <= i or self.count_results(i) == 0:
                 break
             for e in experiments:
                 status, value = self.get_status(e, i)
@@ -401,7 +640,7 @@ class ExperimentEngine(object):
         if os.path.isfile(self.cachefile):
             print("removed: " + self.cachefile)
             os.unlink(self.cachefile)
-            self.results = []
+            self.clear_results()
 
     def run(self, group=None, iterations=None):
         """Run experiments (possibly forever).
@@ -429,7 +668,8 @@ class ExperimentEngine(object):
                         continue
                     # ok, really run the experiment and then sleep for 1 second
                     status, value = experiment.run_experiment(self.timeout, logfile)
-                    self.results[iteration][experiment.name] = status, value
+                    self.set_result(experiment.name, iteration, status, value, get_stat_sig(logfile))
+                    self._neg_cache.pop((iteration, experiment.name), None)
                     time.sleep(1)
             # report that we finished this iteration
             print("Iteration {} done.".format(iteration))
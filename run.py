@@ -79,19 +79,18 @@ def clean():
 
 def csv():
     engine.initialize(ITERATIONS, False)
-    expmap = {e.name: e for e in engine}
-    for i, it in enumerate(engine.results):
+    exp_fields = {e.name: (e.group, e.dataset, e.solver) for e in engine}
+    for i in range(engine.get_iterations()):
         if i > ITERATIONS:
             break
-        for ename, res in it.items():
-            e = expmap[ename]
-            csv_print_experiment(e, res)
+        for ename, status, value in engine.iter_results(i):
+            group, dataset, solver = exp_fields[ename]
+            csv_print_experiment(group, dataset, solver, status, value)
 
 
-def csv_print_experiment(e, res):
-    status, value = res
+def csv_print_experiment(group, dataset, solver, status, value):
     if status == Experiment.TIMEOUT:
-        print("{}; {}; {}; {:.6f}; 0; 0; 0; 0; 0; 0".format(e.group, e.dataset, e.solver, TIMEOUT))
+        sys.stdout.write(f"{group}; {dataset}; {solver}; {TIMEOUT:.6f}; 0; 0; 0; 0; 0; 0\n")
         return
     if status != Experiment.DONE:
         return
@@ -100,9 +99,9 @@ def csv_print_experiment(e, res):
     edges = value.get("edges", 0)
     priorities = value.get("priorities", 0)
     time = value['time']
-    solving = value.get("solving",value["time"])
+    solving = value.get("solving", time)
     metric = value.get("iterations", value.get("promotions", value.get("tangles", -1)))
-    print("{}; {}; {}; {:.6f}; 1; {}; {}; {}; {:.6f}; {}".format(e.group, e.dataset, e.solver, value['time'], nodes, edges, priorities, solving, metric))
+    sys.stdout.write(f"{group}; {dataset}; {solver}; {time:.6f}; 1; {nodes}; {edges}; {priorities}; {solving:.6f}; {metric}\n")
 
 
 def run_group(group_to_run):
@@ -119,19 +118,23 @@ def run():
 def cache():
     engine.initialize(ITERATIONS, True)
     engine.save_cache(True)
-    count_tot = ITERATIONS * sum([1 for i, x in enumerate(engine) if x.repeat]) + sum([1 for i, x in enumerate(engine) if not x.repeat])
-    count_done = sum([len(x) for i, x in enumerate(engine.results) if i < ITERATIONS])
-    count_to = sum([1 for i, x in enumerate(engine.results)
-                    for a, b in x.items() if b[0] == Experiment.TIMEOUT and b[1] < TIMEOUT])
+    exps = list(engine)
+    count_repeat = sum(1 for x in exps if x.repeat)
+    # count results and timeouts to rerun per iteration in a single pass
+    iterations = range(engine.get_iterations())
+    count_done = [engine.count_results(i) for i in iterations]
+    count_to = [sum(1 for _, status, value in engine.iter_results(i) if status == Experiment.TIMEOUT and value < TIMEOUT)
+                if engine.count_results(i, Experiment.TIMEOUT) > 0 else 0
+                for i in iterations]
+    count_tot = ITERATIONS * count_repeat + len(exps) - count_repeat
     print("Remaining: {} experiments not done + {} experiments rerun for higher timeout."
-          .format(count_tot - count_done, count_to))
+          .format(count_tot - sum(count_done[:ITERATIONS]), sum(count_to)))
     for j in range(ITERATIONS):
-        count_tot = sum([1 for i, x in enumerate(engine) if j == 0 or x.repeat])
-        count_done = sum([len(x) for i, x in enumerate(engine.results) if i == j])
-        count_to = sum([1 for i, x in enumerate(engine.results)
-                for a, b in x.items() if b[0] == Experiment.TIMEOUT and b[1] < TIMEOUT and i == j])
+        count_tot = len(exps) if j == 0 else count_repeat
+        done = count_done[j] if j < len(count_done) else 0
+        to = count_to[j] if j < len(count_to) else 0
         print("Iteration {}: {} experiments not done + {} experiments rerun for higher timeout."
-                .format(j, count_tot - count_done, count_to))
+                .format(j, count_tot - done, to))
 
 
 def report():